@@ -1,26 +1,168 @@
 import numpy as np
 
-def pairing(configs):
-    # In each subplot there are more absent species than present (just an observation)
-    # S+ - S-
-    S_present = np.count_nonzero(configs+1)
-    # S_absent = S - S_present -> S_pm = 2*S_present - S
-    S_pm = 2*S_present - 299 # Broadcasting
-    # constraint C_0 = < (S+ - S-)^2 >
-    return np.power(S_pm,2)
+try:
+    from numba import njit, prange
+except ImportError:
+    # numba is optional: without it the sampling loop runs as plain python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+    prange = range
 
+try:
+    from metropolis_core import run_metropolis
+except ImportError:
+    # the C chain is optional as well, built with: python setup.py build_ext --inplace
+    run_metropolis = None
 
-def model_m(configs):
-    # assuming configs have a shape of (n, S) with S = 299
-    return configs.mean(axis=0)
+def pairing(configs, layout = 'AoS'):
+    """Constraint C_0 = < (S+ - S-)^2 >, averaged over the rows of configs (a single configuration is
+       also accepted), or over its columns if layout is 'SoA' (configs of shape (S, n)).
+       For +-1 spins S+ - S- is the sum of the spins, so this is one reduction."""
+    S_pm = configs.sum(axis = 0 if layout == 'SoA' else -1, dtype = np.int64)
+    return float(np.mean(S_pm*S_pm))
 
 
-def compute_energy(configs, L_multipliers):
-    """Computes the energy of a configuration."""
-    model_pair = pairing(configs)
-    #model_m_i = model_m(configs)
-    model_parameters = np.concatenate((model_pair[np.newaxis], configs))
-    return np.dot(model_parameters[1:], L_multipliers[1:]) + model_parameters[0]*L_multipliers[0]/299
+def model_m(configs, layout = 'AoS'):
+    # assuming configs have a shape of (n, S) of +-1 spins ((S, n) if layout is 'SoA'):
+    # m_i = 2*p_i - 1 is the mean spin, a contiguous reduction per site with 'SoA'
+    return configs.mean(axis = 1 if layout == 'SoA' else 0)
+
+
+def compute_energy(configs, L_multipliers, couplings = None):
+    """Computes the energy of a configuration, or of each row of a (n, S) array of configurations.
+
+       E = sum_i l_i s_i + l_0/S (S+ - S-)^2 [+ 1/2 sum_ij J_ij s_i s_j], evaluated as one matrix-vector
+       product for the fields and the closed form of the pairing term (S+ - S- is the sum of the spins)."""
+    S = configs.shape[-1]
+    S_pm = configs.sum(axis = -1)
+    energy = configs @ L_multipliers[1:] + L_multipliers[0]*np.power(S_pm,2)/S
+    if couplings is not None:
+        energy = energy + 0.5*np.sum((configs @ couplings)*configs, axis = -1)
+    return energy
+
+
+def pack(configs):
+    """Packs +-1 spins along the last axis into bits of uint64 words (bit i%64 of word i//64 is 1 for spin +1)."""
+    S = configs.shape[-1]
+    n_words = (S + 63)//64
+    bytes_ = np.zeros(configs.shape[:-1] + (8*n_words,), dtype = np.uint8)
+    bytes_[..., :(S + 7)//8] = np.packbits(configs > 0, axis = -1, bitorder = 'little')
+    return bytes_.view('<u8').astype(np.uint64, copy = False)
+
+
+def unpack(words, S):
+    """Inverse of pack: returns the int8 +-1 spins of S sites stored in the uint64 words."""
+    bits = np.unpackbits(words.astype('<u8', copy = False).view(np.uint8), axis = -1, bitorder = 'little')
+    return (2*bits[..., :S].astype(np.int8) - 1)
+
+
+def packed_sum(words, S):
+    """Sum of the spins (S+ - S-) of packed configurations, from the popcount of the words."""
+    Sp = np.bitwise_count(words).sum(axis = -1, dtype = np.int64)
+    return 2*Sp - S
+
+
+@njit(cache = True)
+def _dE(L_multipliers, S, Sp, spin, index, h):
+    """Same dE as Metropolis.dE, for the compiled kernels. h is None without couplings: numba then
+       compiles (and caches) a separate version of the kernels with the couplings term pruned."""
+    dE = 2*L_multipliers[index+1]*spin + 4*L_multipliers[0]/S*spin*(2*Sp - S + spin)
+    if h is not None:
+        dE += 2*spin*h[index]
+    return dE
+
+
+@njit(cache = True)
+def _update_fields(h, J, spin, index):
+    """Local fields after the flip of spin index to spin: h_i += 2*spin*J_(index,i), J being symmetric."""
+    if h is not None:
+        J_k = J[index]
+        for i in range(h.shape[0]):
+            h[i] += 2*spin*J_k[i]
+
+
+@njit(cache = True)
+def _run_chain(configs, configuration, Sp, L_multipliers, J, h, flip_spins, neg_log_u):
+    """Runs the Metropolis chain from configuration (modified in place) with Sp spins up. flip_spins and
+       neg_log_u have one row per configuration to store: configs[k+1] is the configuration after the
+       flips proposed in row k. J are the couplings and h = J @ configuration the local fields, updated
+       in place (both None without couplings). Returns the number of accepted flips and the final number of spins up."""
+    S = configuration.shape[0]
+    n_accepted = 0
+    for k in range(flip_spins.shape[0]):
+        for j in range(flip_spins.shape[1]):
+            index = flip_spins[k, j]
+            spin = -configuration[index]
+            dE = _dE(L_multipliers, S, Sp, spin, index, h)
+            if dE <= 0 or neg_log_u[k, j] >= dE:
+                configuration[index] = spin
+                Sp += spin
+                _update_fields(h, J, spin, index)
+                n_accepted += 1
+        configs[k+1] = configuration
+    return n_accepted, Sp
+
+
+@njit(cache = True)
+def _run_chain_packed(configs, configuration, Sp, L_multipliers, J, h, flip_spins, neg_log_u):
+    """As _run_chain, but configs holds bit-packed rows (see pack) and configs[0] the packed configuration."""
+    S = configuration.shape[0]
+    words = configs[0].copy()
+    n_accepted = 0
+    for k in range(flip_spins.shape[0]):
+        for j in range(flip_spins.shape[1]):
+            index = flip_spins[k, j]
+            spin = -configuration[index]
+            dE = _dE(L_multipliers, S, Sp, spin, index, h)
+            if dE <= 0 or neg_log_u[k, j] >= dE:
+                configuration[index] = spin
+                Sp += spin
+                _update_fields(h, J, spin, index)
+                words[index >> 6] ^= np.uint64(1) << np.uint64(index & 63)
+                n_accepted += 1
+        configs[k+1] = words
+    return n_accepted, Sp
+
+
+@njit(cache = True)
+def _run_replica(configs, configuration, Sp, beta, L_multipliers, J, h, flip_spins, neg_log_u, store):
+    """One chain of _run_replicas at inverse temperature beta, storing its rows in configs if store.
+       Returns the final number of spins up."""
+    S = configuration.shape[0]
+    for k in range(flip_spins.shape[0]):
+        for j in range(flip_spins.shape[1]):
+            index = flip_spins[k, j]
+            spin = -configuration[index]
+            dE = beta*_dE(L_multipliers, S, Sp, spin, index, h)
+            if dE <= 0 or neg_log_u[k, j] >= dE:
+                configuration[index] = spin
+                Sp += spin
+                _update_fields(h, J, spin, index)
+        if store:
+            configs[k+1] = configuration
+    return Sp
+
+
+@njit(cache = True, parallel = True)
+def _run_replicas(configs, configurations, Sps, betas, L_multipliers, J, hs, flip_spins, neg_log_u):
+    """Runs one independent Metropolis chain per row of configurations (modified in place, with Sps
+       spins up and local fields hs, None without couplings) at inverse temperature betas[c], the chains
+       in parallel. flip_spins and neg_log_u have shape (n_chains, n_rows, sweep_length); configs[k+1]
+       stores the configuration of chain 0 after row k."""
+    for c in prange(configurations.shape[0]):
+        # pruned at compile time on the type of hs
+        if hs is None:
+            Sps[c] = _run_replica(configs, configurations[c], Sps[c], betas[c], L_multipliers, J, None,
+                                  flip_spins[c], neg_log_u[c], c == 0)
+        else:
+            Sps[c] = _run_replica(configs, configurations[c], Sps[c], betas[c], L_multipliers, J, hs[c],
+                                  flip_spins[c], neg_log_u[c], c == 0)
+
+
+# number of proposals drawn at once by Metropolis.sample
+_BLOCK = 1 << 20
 
 
 class Metropolis:
@@ -34,6 +176,17 @@ class Metropolis:
     M              : number of configurations used to compute the running rate of acceptance (memory)
     N              : number of configurations to be sampled
     max_acceptance : acceptance rate under which starts the importance sampling (es. 0.10)
+    seed           : seed of the random number generator (None for a random one)
+    packed         : if True configs stores each configuration as ceil(S/64) uint64 words of bits
+                     (see pack, unpack and packed_sum)
+    sweep_length   : number of proposed flips between two stored configurations (default S, one sweep;
+                     1 stores the configuration after every single proposal)
+    couplings      : optional symmetric S x S matrix J with null diagonal of pairwise couplings, adding
+                     1/2 sum_ij J_ij s_i s_j to the energy
+    dtype          : floating point type of the multipliers, couplings and local fields in the sampling
+                     loop (np.float32 halves the memory traffic of J, well within the statistical error)
+    layout         : 'AoS' to store configs as N rows of S spins, 'SoA' as S rows (one per site) of N
+                     spins, for per-site statistics over the samples (model_m, pairing with layout='SoA')
 
     Attributes
     ------------
@@ -42,58 +195,68 @@ class Metropolis:
     constraint_funcs : list of m functions of the spins of a configuration, to implement the max-ent constraints
     energy           : the Hamiltonian for a configuration of spins is the scalar product between the lagrangian
                         multipliers and the constraint functions computed for the given configuration
-    configs          : numpy ndarray of N rows and S columns, to store the sampled configurations
-    history          : list of the records of all the accepted and refused steps
+    configs          : numpy ndarray (int8) of N rows and S columns, to store the sampled configurations
+                        (S rows and N columns with layout 'SoA', N rows of ceil(S/64) uint64 words if packed)
+    history          : numpy array (uint8) of the outcomes of the calibration proposals (1 accepted, 0 refused)
+    acceptance_rate  : fraction of accepted flips during the sampling
+    h                : local fields h_i = sum_j J_ij s_j of the last configuration (with couplings)
 
     """
 
     def __init__ (self, lagrange_multipliers, exp_constraints, S, M = 100,
-                  N = 1000, max_acceptance = 0.1):
+                  N = 1000, max_acceptance = 0.1, seed = None,
+                  packed = False, sweep_length = None, couplings = None, dtype = np.float64,
+                  layout = 'AoS'):
+        if layout not in ('AoS', 'SoA'):
+            raise ValueError("layout must be 'AoS' or 'SoA'")
+        if packed and layout == 'SoA':
+            raise ValueError("packed configurations are only stored with layout 'AoS'")
         self.S = S # spin glass dimension
         self.M = M # acceptance check interval
         self.N = N # Number of samples after condition reached
         self.max_acceptance = max_acceptance
         self.L_multipliers = lagrange_multipliers
         self.exp_constraints = exp_constraints
-        self.acceptance_history = []
         self.model_configs = None
+        self.packed = packed
+        self.layout = layout
+        self.sweep_length = S if sweep_length is None else sweep_length
+        self.Sp = None # number of spins up in the last configuration of the chain
+        self.dtype = np.dtype(dtype)
+        self.J = None if couplings is None else np.ascontiguousarray(couplings, dtype = self.dtype)
+        self.h = None
+        self.history = None
+        self.acceptance_rate = None
+        self.rng = np.random.default_rng(seed) # PCG64, proposals are drawn in blocks
 
 
     def dE(self, Sp, spin, k):
-        l_k = self.L_multipliers[k]
+        """Energy difference of flipping the k-th spin to the value spin, given Sp spins up.
+
+           Only the flipped spin enters: the field term changes by 2*l_k*spin and the pairing
+           term l_0/S*(S+ - S-)^2 by 4*l_0/S*spin*(S+ - S- + spin), with S+ - S- = 2*Sp - S."""
+        l_k = self.L_multipliers[k+1] # L_multipliers[0] is the pairing multiplier
         l_0 = self.L_multipliers[0]
-        return 2*l_k*spin + 4*self.S*l_0*spin*(2*Sp - self.S + spin) # <----------- VALUES? ( > eps, < 0 ?)
-
-
-    """    def acceptance(self, Sp, spin, k):
-            Implements Metropolis choice.
-            # regularizer?
-            dE = self.dE(Sp, spin, k)
-            if  dE < 0:
-                return True
-            else:
-                P = np.random.random()
-                if P < np.exp(-dE):                 #in teoria no <------------------- BETA?
-                    return True
-                else:
-                    return False
-    """
+        dE = 2*l_k*spin + 4*l_0/self.S*spin*(2*Sp - self.S + spin)
+        if self.J is not None:
+            # the couplings change by 2*spin*h_k, h being the local fields before the flip
+            dE += 2*spin*self.h[k]
+        return dE
 
-    def acceptance(self, new, old):
-        """Implements Metropolis choice."""
-        # regularizer?
-        en1 = compute_energy(new, self.L_multipliers)
-        en2 = compute_energy(old, self.L_multipliers)
 
-        if  (en1-en2) < 0:
-            return True
-        else:
-            P = np.random.random()
-            if P < np.exp(-(en1-en2)):                 #in teoria no <------------------- BETA?
-                return True
-            else:
-                return False
+    def fields(self):
+        """Couplings and local fields as passed to the C extension (empty arrays without couplings)."""
+        if self.J is None:
+            return np.zeros((0, 0), dtype = self.dtype), np.zeros(0, dtype = self.dtype)
+        return self.J, self.h
+
 
+    def acceptance(self, Sp, spin, k, neg_log_u):
+        """Implements Metropolis choice, neg_log_u = -log(u) being an Exponential(1) number."""
+        # regularizer?
+        dE = self.dE(Sp, spin, k)
+        # u < exp(-dE)  <=>  -log(u) > dE, and -log(u) ~ Exponential(1) for u ~ U(0,1)
+        return dE <= 0 or neg_log_u >= dE                 #in teoria no <------------------- BETA?
 
 
     def calibrate(self):
@@ -101,52 +264,239 @@ class Metropolis:
            which the acceptance rate of the last M configurations is under max_acceptance."""
         # M <- ricombinations, N <- sampling
         acceptance_rate = 1
-        configuration = np.random.choice([+1,-1], size = self.S)
+        configuration = self.rng.choice(np.array([+1,-1], dtype = np.int8), size = self.S)
+        # counted once, then only updated by the accepted flips
+        Sp = np.count_nonzero(configuration == 1)
+        if self.J is not None:
+            self.h = (self.J @ configuration).astype(self.dtype)
 
-        while(acceptance_rate > self.max_acceptance):
-            Sp = np.count_nonzero(configuration+1)
+        # preallocated for 10 batches, doubled if the calibration takes longer
+        self.history = np.empty(10*self.M, dtype = np.uint8)
+        n_proposed = 0
 
+        while(acceptance_rate > self.max_acceptance):
+            if n_proposed + self.M > self.history.shape[0]:
+                self.history = np.concatenate((self.history, np.empty_like(self.history)))
             # sort M indexes between 0 and S to flips
-            flip_spins = np.random.randint(low = 0, high = self.S, size = self.M)
-            for index in flip_spins:
-                new = np.copy(configuration) # !!!!!!!
-                new[index] = -configuration[index] # !!!!!!!
-                spin = -configuration[index]
-                if self.acceptance(new, configuration):     # !!!!!
-#                if self.acceptance(Sp, spin, index):     # <-------------- acceptances?
-                    self.acceptance_history.append(1) #
-                    configuration[index] = spin
+            flip_spins = self.rng.integers(low = 0, high = self.S, size = self.M)
+            neg_log_u = self.rng.standard_exponential(self.M)
+            for index, neg_log_u_k in zip(flip_spins, neg_log_u):
+                # tentative flip in place, undone with a single store if refused
+                configuration[index] *= -1
+                spin = int(configuration[index]) # python int, Sp must not wrap as int8
+                accepted = self.acceptance(Sp, spin, index, neg_log_u_k)
+                self.history[n_proposed] = accepted
+                n_proposed += 1
+                if accepted:
                     Sp += spin # trick step
+                    if self.J is not None:
+                        self.h += 2*spin*self.J[index] # axpy on the local fields
+                else:
+                    configuration[index] *= -1
 
-            acceptance_rate = len(self.acceptance_history)/self.M
-            self.acceptance_history = []
+            acceptance_rate = self.history[n_proposed - self.M:n_proposed].mean()
 
-        self.model_configs[0] = configuration
+        self.history = self.history[:n_proposed]
+        self.configs_rows()[0] = pack(configuration) if self.packed else configuration
+        self.Sp = Sp
         return configuration
 
+    def configs_rows(self):
+        """View of model_configs with one configuration per row, whatever the layout."""
+        return self.model_configs.T if self.layout == 'SoA' else self.model_configs
+
+
     def sample(self, N = None):
         """Computes and returns N configurations of the system."""
         if N != None:
             self.N = N
-        self.model_configs = np.zeros((self.N,self.S))
+        # spins are +-1: int8 storage, every row is overwritten so no need to zero it
+        if self.packed:
+            # 1 bit per spin
+            self.model_configs = np.empty((self.N,(self.S + 63)//64), dtype = np.uint64)
+        elif self.layout == 'SoA':
+            self.model_configs = np.empty((self.S,self.N), dtype = np.int8)
+        else:
+            self.model_configs = np.empty((self.N,self.S), dtype = np.int8)
         configuration = self.calibrate()
-        Sp = np.count_nonzero(configuration+1)
+        configs = self.configs_rows()
 
         # at the end of calibration the first configuration is already stored,
         # thus we have to sample other N-1 configurations
 
-        # sort M indexes between 0 and S to flips
-        flip_spins = np.random.randint(low = 0, high = self.S, size = self.N-1)
+        L_multipliers = np.ascontiguousarray(self.L_multipliers, dtype = self.dtype)
 
-        for k, index in enumerate(flip_spins):
-            spin = -configuration[index]
-            if self.acceptance(Sp, spin, index):
-                configuration[index] = spin
-                Sp += spin
-                # if the new config is chosen, we memorize it
-                self.model_configs[k + 1] = configuration
-            else:
-                # otherwise we store another time the last config
-                self.model_configs[k + 1] = configuration
+        if run_metropolis is not None and not self.packed and self.layout == 'AoS':
+            J, h = self.fields()
+            # C extension: the random numbers are generated inside the loop
+            n_accepted, self.Sp = run_metropolis(self.model_configs, configuration, self.Sp, L_multipliers, J, h,
+                                                 self.sweep_length, self.rng.integers(2**63))
+            self.acceptance_rate = n_accepted/max((self.N-1)*self.sweep_length, 1)
+            return self.model_configs
+
+        # otherwise the chain runs compiled by numba (when available), on blocks of rows so that
+        # the proposals of the whole run are never held in memory at once
+        run_chain = _run_chain_packed if self.packed else _run_chain
+        block_rows = max(1, _BLOCK//self.sweep_length)
+        n_accepted = 0
+        for start in range(0, self.N-1, block_rows):
+            n_rows = min(block_rows, self.N-1 - start)
+            # sort sweep_length indexes between 0 and S to flip for each row
+            flip_spins = self.rng.integers(low = 0, high = self.S, size = (n_rows, self.sweep_length))
+            neg_log_u = self.rng.standard_exponential((n_rows, self.sweep_length))
+            # row 0 of the slice is the last stored configuration
+            n_accepted_block, self.Sp = run_chain(configs[start:start + n_rows + 1], configuration,
+                                                  self.Sp, L_multipliers, self.J, self.h, flip_spins, neg_log_u)
+            n_accepted += n_accepted_block
+        self.acceptance_rate = n_accepted/max((self.N-1)*self.sweep_length, 1)
+
+        return self.model_configs
+
+
+class ParallelMetropolis(Metropolis):
+    """
+    Parallel tempering: n_chains Metropolis chains of the same Hamiltonian at different temperatures,
+    run in parallel, with swaps of the configurations of neighbouring temperatures accepted with
+    probability min(1, exp((beta_i - beta_j)*(E_i - E_j))). Only the chain at the first temperature
+    (the physical one, 1) is stored, the hotter ones help it cross the energy barriers.
+
+    Parameters
+    ------------
+
+    temperatures   : increasing list of the temperatures of the chains, the first one is sampled (es. 1.0)
+    swap_interval  : number of stored configurations (sweeps) between two rounds of swap proposals
+    burn_in        : number of sweeps run before storing the first configuration (replaces calibrate)
+    S, N, seed, sweep_length, couplings, dtype as in Metropolis
+
+    Attributes
+    ------------
+
+    configurations : numpy ndarray (int8) of n_chains rows and S columns, the current state of each chain
+                     (after the last round of swaps, so row 0 can differ from the last stored configuration)
+    Sps            : number of spins up of each row of configurations
+    swap_rate      : fraction of accepted swaps between temperatures k and k+1 in the last sample
+
+    """
+
+    def __init__ (self, lagrange_multipliers, exp_constraints, S, temperatures = (1.0, 1.2, 1.44, 1.728),
+                  swap_interval = 1, burn_in = 100, N = 1000, seed = None, sweep_length = None,
+                  couplings = None, dtype = np.float64):
+        super().__init__(lagrange_multipliers, exp_constraints, S, N = N, seed = seed,
+                         sweep_length = sweep_length, couplings = couplings, dtype = dtype)
+        self.betas = 1/np.asarray(temperatures, dtype = np.float64)
+        self.n_chains = len(self.betas)
+        self.swap_interval = swap_interval
+        self.burn_in = burn_in
+        self.configurations = None
+        self.Sps = None
+        self.hs = None
+        self.swap_rate = None
+
+
+    def swap(self, L_multipliers):
+        """Proposes the swap of the configurations of each pair of neighbouring temperatures."""
+        energies = compute_energy(self.configurations, L_multipliers, self.J)
+        neg_log_u = self.rng.standard_exponential(self.n_chains - 1)
+        n_swaps = np.zeros(self.n_chains - 1, dtype = np.int64)
+        for k in range(self.n_chains - 1):
+            # -log of the acceptance ratio of the swap
+            d = -(self.betas[k] - self.betas[k+1])*(energies[k] - energies[k+1])
+            if d <= 0 or neg_log_u[k] >= d:
+                self.configurations[[k, k+1]] = self.configurations[[k+1, k]]
+                self.Sps[[k, k+1]] = self.Sps[[k+1, k]]
+                if self.hs is not None:
+                    self.hs[[k, k+1]] = self.hs[[k+1, k]]
+                energies[[k, k+1]] = energies[[k+1, k]]
+                n_swaps[k] = 1
+        return n_swaps
+
+
+    def run(self, configs, n_rows):
+        """Runs n_rows sweeps of all the chains, storing the ones of the first chain in configs[1:]."""
+        L_multipliers = np.asarray(self.L_multipliers, dtype = self.dtype)
+        shape = (self.n_chains, n_rows, self.sweep_length)
+        flip_spins = self.rng.integers(low = 0, high = self.S, size = shape)
+        neg_log_u = self.rng.standard_exponential(shape)
+        _run_replicas(configs, self.configurations, self.Sps, self.betas, L_multipliers, self.J, self.hs,
+                      flip_spins, neg_log_u)
+        return self.swap(L_multipliers)
+
+
+    def sample(self, N = None):
+        """Computes and returns N configurations of the system at the first temperature."""
+        if N != None:
+            self.N = N
+        self.configurations = self.rng.choice(np.array([+1,-1], dtype = np.int8), size = (self.n_chains, self.S))
+        self.Sps = np.count_nonzero(self.configurations == 1, axis = 1).astype(np.int64)
+        if self.J is None:
+            self.hs = None
+        else:
+            # J symmetric: row c is J @ configurations[c]
+            self.hs = (self.configurations @ self.J).astype(self.dtype)
+
+        # burn in, in rounds of swap_interval sweeps whose configurations are thrown away
+        scratch = np.empty((self.swap_interval + 1, self.S), dtype = np.int8)
+        for start in range(0, self.burn_in, self.swap_interval):
+            self.run(scratch, min(self.swap_interval, self.burn_in - start))
+
+        self.model_configs = np.empty((self.N,self.S), dtype = np.int8)
+        self.model_configs[0] = self.configurations[0]
+        n_swaps = np.zeros(self.n_chains - 1, dtype = np.int64)
+        n_rounds = 0
+        for start in range(0, self.N-1, self.swap_interval):
+            n_rows = min(self.swap_interval, self.N-1 - start)
+            # row 0 of the slice is the last stored configuration
+            n_swaps += self.run(self.model_configs[start:start + n_rows + 1], n_rows)
+            n_rounds += 1
+        self.swap_rate = n_swaps/max(n_rounds, 1)
+        # the last round of swaps may have changed the first chain after its last row was stored
+        self.Sp = int(np.count_nonzero(self.model_configs[-1] == 1))
 
         return self.model_configs
+
+
+if __name__ == '__main__':
+    # self checks (python metropolis.py)
+    import itertools
+    rng = np.random.default_rng(0)
+
+    # pack/unpack round trip and popcount sum, with S not a multiple of 64
+    configs = rng.choice(np.array([+1,-1], dtype = np.int8), size = (50, 130))
+    words = pack(configs)
+    assert words.shape == (50, 3) and words.dtype == np.uint64
+    assert np.array_equal(unpack(words, 130), configs)
+    assert np.array_equal(packed_sum(words, 130), configs.sum(axis = 1))
+
+    # exact enumeration: the frequencies of the 2^S configurations of a small system are Boltzmann's
+    S = 4
+    L_multipliers = 0.5*rng.normal(size = S+1)
+    J = 0.5*rng.normal(size = (S,S))
+    J = (J + J.T)/2
+    np.fill_diagonal(J, 0)
+    states = np.array(list(itertools.product([+1,-1], repeat = S)), dtype = np.int8)
+    P = np.exp(-compute_energy(states, L_multipliers, J))
+    P /= P.sum()
+
+    def max_deviation(configs):
+        # index of each configuration in states, read as the binary number of its spins down
+        index = (configs < 0).astype(np.int64) @ 2**np.arange(S)[::-1]
+        return np.abs(np.bincount(index, minlength = len(states))/len(configs) - P).max()
+
+    for dtype in (np.float64, np.float32):
+        for kwargs in (dict(), dict(packed = True), dict(layout = 'SoA')):
+            # max_acceptance = 1 skips the calibration, the chain starts at equilibrium after few sweeps
+            chain = Metropolis(L_multipliers, None, S, N = 100000, max_acceptance = 1.0, seed = 1,
+                               sweep_length = 3, couplings = J, dtype = dtype, **kwargs)
+            configs = chain.sample()
+            if chain.packed:
+                configs = unpack(configs, S)
+            elif chain.layout == 'SoA':
+                configs = configs.T
+            assert max_deviation(configs) < 0.01, (dtype, kwargs)
+            assert chain.Sp == np.count_nonzero(configs[-1] == 1)
+        chain = ParallelMetropolis(L_multipliers, None, S, temperatures = (1.0, 1.5), swap_interval = 10, N = 100000,
+                                   seed = 1, sweep_length = 3, couplings = J, dtype = dtype)
+        configs = chain.sample()
+        assert max_deviation(configs) < 0.01, dtype
+        assert chain.Sp == np.count_nonzero(configs[-1] == 1)
+    print('ok')
@@ -1,27 +1,22 @@
 import numpy as np
 
 def pairing(configs):
-    # In each subplot there are more absent species than present (just an observation)
-    # S+ - S-
-    S_present = np.count_nonzero(configs, axis = (1)).flatten()
-    # S_absent = S - S_present -> S_pm = 2*S_present - S
-    S_pm = 2*S_present - S # Broadcasting
+    # S+ - S- is the sum of the +-1 spins of each configuration
+    S_pm = configs.sum(axis = 1, dtype = np.int64)
     # constraint C_0 = < (S+ - S-)^2 >
-    return np.mean(np.power(S_pm,2))
+    return float(np.mean(S_pm*S_pm))
 
 
 def model_m(configs):
-    # assuming configs have a shape of (n, S) with S = 299
-    p_i = np.count_nonzero(configs, axis = 0)/configs.shape[0]
-    return 2*p_i - 1
+    # assuming configs have a shape of (n, S) of +-1 spins: 2*p_i - 1 is the mean spin
+    return configs.mean(axis = 0)
 
 
 def compute_energy(configs, L_multipliers):
     """Computes the energy of a configuration."""
-    model_pair = pairing(configs)
-    model_m_i = model_m(configs)
-    model_parameters = np.concatenate((model_pair[np.newaxis], model_m_i))
-    return np.dot(model_parameters, L_multipliers)
+    # L_multipliers[0] multiplies the pairing, L_multipliers[1:] the magnetizations:
+    # no need to concatenate the constraints in a temporary array
+    return L_multipliers[0]*pairing(configs) + model_m(configs) @ L_multipliers[1:]
 
 
 class Metropolis:
@@ -56,8 +51,8 @@ class Metropolis:
         self.max_acceptance = max_acceptance
         self.L_multipliers = lagrange_multipliers
         self.exp_constraints = exp_constraints
-        self.acceptance_history = []
         self.model_configs = None
+        self.Sp = None # number of spins up in the last configuration of the chain
 
 
     def dE(self, Sp, spin, k):
@@ -66,18 +61,12 @@ class Metropolis:
         return 2*l_k*spin + 4*l_0*spin*(2*Sp - self.S + spin) # <----------- VALUES? ( > eps, < 0 ?)
 
 
-    def acceptance(self, Sp, spin, k):
-        """Implements Metropolis choice."""
+    def acceptance(self, Sp, spin, k, neg_log_u):
+        """Implements Metropolis choice, neg_log_u = -log(u) being an Exponential(1) number."""
         # regularizer?
         dE = self.dE(Sp, spin, k)
-        if  dE < 0:
-            return True
-        else:
-            P = np.random.random()
-            if P < np.exp(-dE):                 #in teoria no <------------------- BETA?
-                return True
-            else:
-                return False
+        # u < exp(-dE)  <=>  -log(u) > dE, and -log(u) ~ Exponential(1) for u ~ U(0,1)
+        return dE <= 0 or neg_log_u >= dE                 #in teoria no <------------------- BETA?
 
 
     def calibrate(self):
@@ -85,50 +74,52 @@ class Metropolis:
            which the acceptance rate of the last M configurations is under max_acceptance."""
         # M <- ricombinations, N <- sampling
         acceptance_rate = 1
-        configuration = np.random.choice([+1,-1], size = self.S)
+        configuration = np.random.choice(np.array([+1,-1], dtype = np.int8), size = self.S)
+        # counted once, then only updated by the accepted flips
+        Sp = np.count_nonzero(configuration == 1)
 
         while(acceptance_rate > self.max_acceptance):
-            Sp = np.count_nonzero(configuration+1)
-
+            n_accepted = 0
             # sort M indexes between 0 and S to flips
             flip_spins = np.random.randint(low = 0, high = self.S, size = self.M)
+            neg_log_u = np.random.standard_exponential(self.M)
 
-            for index in flip_spins:
-                spin = -configuration[index]
-                if self.acceptance(Sp, spin, index):     # <-------------- acceptances?
-                    self.acceptance_history.append(1) #
+            for index, neg_log_u_k in zip(flip_spins, neg_log_u):
+                spin = -int(configuration[index]) # python int, Sp must not wrap as int8
+                if self.acceptance(Sp, spin, index, neg_log_u_k):     # <-------------- acceptances?
+                    n_accepted += 1
                     configuration[index] = spin
                     Sp += spin # trick step
 
-            acceptance_rate = len(self.acceptance_history)/self.M
-            self.acceptance_history = []
+            acceptance_rate = n_accepted/self.M
 
         self.model_configs[0] = configuration
+        self.Sp = Sp
         return configuration
 
     def sample(self, N = None):
         """Computes and returns N configurations of the system."""
         if N != None:
             self.N = N
-        self.model_configs = np.zeros((self.N,self.S))
+        # spins are +-1: int8 storage, every row is overwritten so no need to zero it
+        self.model_configs = np.empty((self.N,self.S), dtype = np.int8)
         configuration = self.calibrate()
-        Sp = np.count_nonzero(configuration+1)
+        Sp = self.Sp
 
         # at the end of calibration the first configuration is already stored,
         # thus we have to sample other N-1 configurations
 
         # sort M indexes between 0 and S to flips
         flip_spins = np.random.randint(low = 0, high = self.S, size = self.N-1)
+        neg_log_u = np.random.standard_exponential(self.N-1)
 
         for k, index in enumerate(flip_spins):
-            spin = -configuration[index]
-            if self.acceptance(Sp, spin, index):
+            spin = -int(configuration[index])
+            if self.acceptance(Sp, spin, index, neg_log_u[k]):
                 configuration[index] = spin
                 Sp += spin
-                # if the new config is chosen, we memorize it
-                self.model_configs[k + 1] = configuration
-            else:
-                # otherwise we store another time the last config
-                self.model_configs[k + 1] = configuration
+            # the new config if chosen, otherwise another time the last one
+            self.model_configs[k + 1] = configuration
 
+        self.Sp = Sp
         return self.model_configs
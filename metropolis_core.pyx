@@ -0,0 +1,82 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled Metropolis chain used by metropolis.Metropolis.sample when built
+(python setup.py build_ext --inplace). Same Hamiltonian and dE as metropolis.py,
+with a xoshiro256++ generator kept in local variables.
+"""
+from cython cimport floating
+from libc.math cimport exp
+from libc.stdint cimport int8_t, uint64_t
+from libc.string cimport memcpy
+
+
+cdef inline uint64_t rotl(uint64_t x, int k) nogil:
+    return (x << k) | (x >> (64 - k))
+
+
+cdef inline uint64_t splitmix64(uint64_t *x) nogil:
+    # used only to seed the xoshiro state from a single integer
+    x[0] += <uint64_t>0x9e3779b97f4a7c15
+    cdef uint64_t z = x[0]
+    z = (z ^ (z >> 30))*<uint64_t>0xbf58476d1ce4e5b9
+    z = (z ^ (z >> 27))*<uint64_t>0x94d049bb133111eb
+    return z ^ (z >> 31)
+
+
+cdef inline uint64_t next_xoshiro(uint64_t *s) nogil:
+    # xoshiro256++, s being the 4 words of state
+    cdef uint64_t result = rotl(s[0] + s[3], 23) + s[0]
+    cdef uint64_t t = s[1] << 17
+    s[2] ^= s[0]
+    s[3] ^= s[1]
+    s[1] ^= s[2]
+    s[0] ^= s[3]
+    s[2] ^= t
+    s[3] = rotl(s[3], 45)
+    return result
+
+
+def run_metropolis(int8_t[:, ::1] configs, int8_t[::1] configuration, long Sp, floating[::1] L_multipliers,
+                   floating[:, ::1] J, floating[::1] h, Py_ssize_t sweep_length, uint64_t seed):
+    """Runs the Metropolis chain from configuration (modified in place) with Sp spins up, storing in
+       configs[k+1] the configuration after the k-th sweep of sweep_length proposed flips. J are the
+       couplings and h = J @ configuration the local fields, updated in place (both empty without
+       couplings). L_multipliers, J and h are all float32 or all float64. Returns the number of accepted
+       flips and the final number of spins up."""
+    cdef Py_ssize_t S = configuration.shape[0]
+    cdef Py_ssize_t n_rows = configs.shape[0] - 1
+    cdef bint has_J = h.shape[0] > 0
+    cdef floating l_0 = L_multipliers[0]
+    cdef Py_ssize_t k, j, i, index
+    cdef long spin
+    cdef long n_accepted = 0
+    cdef floating dE
+    cdef double u
+    cdef uint64_t state[4]
+    cdef uint64_t x = seed
+
+    for i in range(4):
+        state[i] = splitmix64(&x)
+
+    with nogil:
+        for k in range(n_rows):
+            for j in range(sweep_length):
+                # multiply-shift reduction of the upper 32 bits to [0, S)
+                index = <Py_ssize_t>(((next_xoshiro(state) >> 32)*<uint64_t>S) >> 32)
+                # uniform in [0, 1) from the upper 53 bits
+                u = (next_xoshiro(state) >> 11)*(1.0/9007199254740992.0)
+
+                spin = -configuration[index]
+                dE = 2*L_multipliers[index+1]*spin + 4*l_0/S*spin*(2*Sp - S + spin)
+                if has_J:
+                    dE += 2*spin*h[index]
+                if dE <= 0 or u < exp(-dE):
+                    configuration[index] = <int8_t>spin
+                    Sp += spin
+                    n_accepted += 1
+                    if has_J:
+                        for i in range(S):
+                            h[i] += 2*spin*J[index, i]
+            memcpy(&configs[k+1, 0], &configuration[0], S)
+
+    return n_accepted, Sp
@@ -0,0 +1,107 @@
+import numpy as np
+
+try:
+    import cupy as xp
+except ImportError:
+    # cupy is optional: without it the chains run in lockstep on the cpu with numpy
+    xp = np
+
+
+def to_numpy(array):
+    """Copies an array of the device back to the host (no copy with numpy)."""
+    return xp.asnumpy(array) if xp is not np else array
+
+
+class MetropolisBatch:
+    """
+    n_chains independent Metropolis chains of the Ising model of metropolis.Metropolis, advanced in lockstep
+    as a (n_chains, S) state matrix, on the gpu when cupy is available. At each step every chain proposes the
+    flip of one spin: the energy differences, acceptances and local field updates of all the chains are
+    single array operations sharing the couplings matrix.
+
+    Parameters
+    ------------
+
+    S              : number of spins of a configuration (size of the system)
+    n_chains       : number of independent chains
+    N              : number of configurations to be sampled for each chain
+    sweep_length   : number of proposed flips between two stored configurations (default S, one sweep)
+    burn_in        : number of sweeps run before storing the first configuration
+    couplings      : optional symmetric S x S matrix J with null diagonal of pairwise couplings
+    seed           : seed of the random number generator (None for a random one)
+    dtype          : floating point type of the multipliers, couplings and local fields
+
+    Attributes
+    ------------
+
+    L_multipliers  : array (on the device) of the S+1 Lagrange multipliers, L_multipliers[0] for the pairing
+    configurations : (n_chains, S) int8 array on the device, the current state of each chain
+    Sps            : number of spins up of each chain
+    h              : (n_chains, S) local fields h = configurations @ J (with couplings)
+    model_configs  : numpy ndarray (int8) of shape (N, n_chains, S) of the sampled configurations
+
+    """
+
+    def __init__ (self, lagrange_multipliers, S, n_chains = 64, N = 1000, sweep_length = None, burn_in = 100,
+                  couplings = None, seed = None, dtype = np.float32):
+        self.S = S
+        self.n_chains = n_chains
+        self.N = N
+        self.sweep_length = S if sweep_length is None else sweep_length
+        self.burn_in = burn_in
+        self.dtype = dtype
+        self.L_multipliers = xp.asarray(lagrange_multipliers, dtype = dtype)
+        self.J = None if couplings is None else xp.asarray(couplings, dtype = dtype)
+        self.rng = xp.random.default_rng(seed)
+        self.chains = xp.arange(n_chains)
+        self.configurations = None
+        self.Sps = None
+        self.h = None
+        self.model_configs = None
+
+
+    def step(self):
+        """Proposes and accepts or refuses the flip of one random spin in every chain."""
+        index = self.rng.integers(0, self.S, size = self.n_chains)
+        spin = -self.configurations[self.chains, index].astype(self.dtype)
+        # same dE as Metropolis.dE, for all the chains at once
+        dE = (2*self.L_multipliers[index+1]*spin
+              + 4*self.L_multipliers[0]/self.S*spin*(2*self.Sps - self.S + spin))
+        if self.J is not None:
+            dE += 2*spin*self.h[self.chains, index]
+        accepted = (dE <= 0) | (self.rng.standard_exponential(self.n_chains, dtype = self.dtype) >= dE)
+
+        flip = xp.where(accepted, spin, 0).astype(self.dtype) # spin where accepted, 0 elsewhere
+        self.configurations[self.chains, index] = xp.where(accepted, spin, -spin).astype(np.int8)
+        self.Sps += flip.astype(np.int64)
+        if self.J is not None:
+            # one axpy per chain with the row of the flipped spin, all in a single call
+            self.h += (2*flip)[:, None]*self.J[index]
+
+
+    def sweep(self):
+        for _ in range(self.sweep_length):
+            self.step()
+
+
+    def sample(self, N = None):
+        """Computes and returns N configurations of each chain, as a numpy array of shape (N, n_chains, S)."""
+        if N != None:
+            self.N = N
+        self.configurations = (2*self.rng.integers(0, 2, size = (self.n_chains, self.S)) - 1).astype(np.int8)
+        self.Sps = xp.count_nonzero(self.configurations == 1, axis = 1).astype(np.int64)
+        if self.J is not None:
+            # J symmetric: row c is J @ configurations[c]
+            self.h = self.configurations.astype(self.dtype) @ self.J
+
+        for _ in range(self.burn_in):
+            self.sweep()
+
+        configs = xp.empty((self.N, self.n_chains, self.S), dtype = np.int8)
+        configs[0] = self.configurations
+        for k in range(1, self.N):
+            self.sweep()
+            configs[k] = self.configurations
+
+        self.model_configs = to_numpy(configs)
+        return self.model_configs
@@ -0,0 +1,8 @@
+"""Builds the optional compiled Metropolis chain: python setup.py build_ext --inplace"""
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+extensions = [Extension("metropolis_core", ["metropolis_core.pyx"],
+                        extra_compile_args = ["-O3", "-march=native", "-ffast-math"])]
+
+setup(name = "metropolis_core", ext_modules = cythonize(extensions))